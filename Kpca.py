@@ -1,6 +1,112 @@
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import numpy as np
 from scipy.linalg import eigh
 
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    prange = range
+    HAS_NUMBA = False
+
+try:
+    import simsimd
+    HAS_SIMSIMD = True
+except ImportError:
+    HAS_SIMSIMD = False
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+try:
+    import cupy as cp
+    HAS_CUPY = True
+except ImportError:
+    cp = None
+    HAS_CUPY = False
+
+# above this many features the BLAS GEMM route outruns direct distances
+SIMSIMD_MAX_FEATURES = 32
+
+
+def _rbf_finalize(G, xs_norm, x_norm, gamma):
+    """Turns the cross products G = X_S.X^T into the rbf kernel in place,
+    forming the squared distance and its exponential in a single pass."""
+    for i in prange(G.shape[0]):
+        for j in range(G.shape[1]):
+            d = xs_norm[i] + x_norm[j] - 2.0*G[i,j]
+            G[i,j] = math.exp(-gamma*d if d > 0 else 0.0)
+
+_rbf_finalize_serial = _rbf_finalize
+if HAS_NUMBA:
+    # the serial variant is safe to call from several threads at once
+    _rbf_finalize_serial = njit(fastmath=True)(_rbf_finalize)
+    _rbf_finalize = njit(parallel=True, fastmath=True, cache=True)(_rbf_finalize)
+
+
+def _poly_finalize(G, order):
+    """Turns the cross products G = X_S.X^T into the polynomial kernel
+    (G + 1)^order in place."""
+    for i in prange(G.shape[0]):
+        for j in range(G.shape[1]):
+            G[i,j] = (G[i,j] + 1.0)**order
+
+_poly_finalize_serial = _poly_finalize
+if HAS_NUMBA:
+    _poly_finalize_serial = njit(fastmath=True)(_poly_finalize)
+    _poly_finalize = njit(parallel=True, fastmath=True, cache=True)(_poly_finalize)
+
+
+def _recon_finalize(proj, ksum_col, krow_alphs, sumalphs, Ksum, kxx, out):
+    """Writes the reconstruction error of each row of proj = k_L^T.alphs to
+    out, applying the centering corrections and the squared norm per row.
+    kxx holds the kernel diagonal k(x,x) of the rows."""
+    for i in prange(proj.shape[0]):
+        c = ksum_col[i] - Ksum
+        acc = 0.0
+        for k in range(proj.shape[1]):
+            v = proj[i,k] - sumalphs[k]*c - krow_alphs[k]
+            acc += v*v
+        out[i] = kxx[i] - 2.0*ksum_col[i] + Ksum - acc
+
+_recon_finalize_serial = _recon_finalize
+if HAS_NUMBA:
+    _recon_finalize_serial = njit(fastmath=True)(_recon_finalize)
+    _recon_finalize = njit(parallel=True, fastmath=True, cache=True)(_recon_finalize)
+
+
+def _symmetrize(K, block_size = 256):
+    """Replaces the square matrix K by (K + K^T)/2 in place. Works on one
+    strip of rows at a time so only a (block_size x n) temporary is needed."""
+    n = K.shape[0]
+    for i in range(0, n, block_size):
+        j = min(i + block_size, n)
+        avg = K[i:j, i:] + K[i:, i:j].T
+        avg *= 0.5
+        K[i:j, i:] = avg
+        K[i:, i:j] = avg.T
+    return K
+
+
+def _center_upper(K, Krow, Ksum, block_size = 256):
+    """Centers the upper triangle of the symmetric gram matrix K in place,
+    K[i,j] - Krow[i] - Krow[j] + Ksum for i <= j. The strict lower triangle
+    is left as is apart from the diagonal blocks."""
+    n = K.shape[0]
+    for i in range(0, n, block_size):
+        j = min(i + block_size, n)
+        strip = K[i:j, i:]
+        strip -= Krow[i:j, None]
+        strip -= Krow[None, i:]
+        strip += Ksum
+    return K
+
 class kPCA:
     """
     Parameters
@@ -35,6 +141,34 @@ class kPCA:
     verbose : bool, (default: False)
         Prints out runtime and feedback
 
+    use_nystrom : bool, optional (default=False)
+        Use a Nystrom low-rank approximation of the gram matrix when the
+        training sample is larger than n_landmarks. The feature space is
+        then centered on the mean of the landmarks rather than on the mean
+        of the whole sample, so the scores are an approximation of the exact
+        ones on top of the low-rank error
+
+    n_landmarks : int, optional (default=2000)
+        Number of landmark points sampled for the Nystrom approximation
+
+    seed : int, optional (default=None)
+        Seed of the random generator used for subsampling
+
+    dtype : numpy float type, optional (default=None)
+        Precision of the kernel and eigendecomposition computations. If None,
+        float64 is used. np.float32 halves the memory and bandwidth but loses
+        precision in the reconstruction error, small scores can turn negative
+
+    n_jobs : int, optional (default=1)
+        Number of threads scoring batches concurrently, -1 uses all cores.
+        With n_jobs > 1 each batch runs single threaded to avoid
+        oversubscription
+
+    device : string, optional (default='cpu')
+        One of 'cpu' or 'cuda'. With 'cuda' the gram matrices, the dense
+        eigendecomposition and the batch scoring run on the GPU through
+        CuPy. The fitted model attributes are kept on the host
+
     useAll : bool, (default = True )
         #Use the full dataset for the evaluation projection?
 
@@ -45,8 +179,11 @@ class kPCA:
         sample of X used for calulating alphas, typically the full sample is \
         used so that X_S = X. Sampling set by sample_pct
 
-    model_K_mat : numpy array of shape (n_sub,sub)
-        uncentered gram matrix after training
+    model_Krow : numpy array of shape (n_sub,)
+        column means of the uncentered gram matrix after training
+
+    model_xs_norm_sq : numpy array of shape (n_sub,)
+        squared row norms of model_X_S, reused by every scoring batch
 
     model_alphas : numpy array of shape (n_samples, q)
         retained eigen values after training
@@ -70,7 +207,10 @@ class kPCA:
 
     def __init__(self, order = 3, q = 'same', sigma = 1.0,
                  sample_pct = 1.0, shrinking=True, batch_size = 500,
-                 contamination = 0.1, verbose=False):
+                 contamination = 0.1, verbose=False, use_nystrom=False,
+                 n_landmarks = 2000, seed = None, dtype = None, n_jobs = 1,
+                 device = 'cpu', kernel = 'rbf'):
+        self.kernel = kernel
         self.sigma = sigma
         self.gamma = 1/2/sigma/sigma
         self.order = order
@@ -79,6 +219,32 @@ class kPCA:
         self.batch_size = batch_size
         self.contamination = contamination
         self.verbose = verbose
+        self.use_nystrom = use_nystrom
+        self.n_landmarks = n_landmarks
+        self.rng = np.random.default_rng(seed)
+        self.dtype = dtype
+        self.n_jobs = n_jobs
+        self.device = device
+
+        if kernel not in ('rbf', 'poly'):
+            raise ValueError("kernel must be one of 'rbf' or 'poly'")
+
+        if device == 'cuda' and not HAS_CUPY:
+            raise ImportError("device='cuda' requires cupy")
+
+        if isinstance(n_jobs, bool) or not isinstance(n_jobs, (int, np.integer)) \
+                or not (n_jobs == -1 or n_jobs > 0):
+            raise ValueError("n_jobs must be a positive integer or -1")
+
+
+    def _to_device(self, A):
+        """Returns A on the compute device (a cupy array when device='cuda')"""
+        return cp.asarray(A) if self.device == 'cuda' else A
+
+
+    def _to_host(self, A):
+        """Returns A as a numpy array on the host"""
+        return cp.asnumpy(A) if self.device == 'cuda' else A
 
 
     def subsample_data(self,X, sample_pct = None):
@@ -88,19 +254,24 @@ class kPCA:
         ----------
         X : numpy array of shape (n_samples, d_features)
             The input samples.
-        sample_pct: float, percentage (0,1) to sample from X
+        sample_pct: float, percentage (0,1) to sample from X, defaults to
+            self.sample_pct if None
         """
 
+        if sample_pct is None:
+            sample_pct = self.sample_pct
+
         n_sub = int(sample_pct * X.shape[0])
 
-        sample_idx = np.random.permutation(n_sub)
+        sample_idx = self.rng.choice(X.shape[0], size=n_sub, replace=False, shuffle=False)
 
         X_s = X[sample_idx]
 
         return X_s
 
 
-    def gramMatrix(self,X, X_S, params = None):
+    def gramMatrix(self,X, X_S, params = None, parallel = True, xs_norm_sq = None,
+                   out = None):
         """Returns the (n x n) gram matrix based on the kernel.
 
         Parameters
@@ -112,29 +283,111 @@ class kPCA:
             kernel function to use options
 
         params: float, kernel parameter, defaults to sigma or order if None
-        """
 
+        parallel: bool, use multiple threads for the kernel evaluation
 
-        a = np.expand_dims(np.diag(X_S.dot(X_S.T)),axis = 1).dot(np.ones((1, X.shape[0])))
-        b = np.ones((X_S.shape[0],1)).dot(np.expand_dims(np.diag(X.dot(X.T)),axis = 0))
-    
-        sqrd_dists = a + b - 2*X_S.dot(X.T)
+        xs_norm_sq: numpy array of shape (n_sub,), optional precomputed
+            squared row norms of X_S
 
-        # RBF
-        params = self.gamma
-        K = np.exp(-params*sqrd_dists)
+        out: numpy array of shape (n_sub, n_samples), optional C-contiguous
+            buffer of the input dtype the kernel is written into (cpu only)
+        """
 
-        # Poly
-        #params = self.order
-        #K = np.power((sqrd_dists +1),params)
+        # RBF
+        params = X.dtype.type(self.gamma) if X.dtype.kind == 'f' else self.gamma
+
+        if self.device == 'cuda':
+            X_S, X = cp.asarray(X_S), cp.asarray(X)
+            if self.kernel == 'poly':
+                K = X_S.dot(X.T)
+                K += 1.0
+                return cp.power(K, self.order, out=K)
+            if xs_norm_sq is None:
+                xs_norm_sq = cp.einsum('ij,ij->i', X_S, X_S)
+            K = X_S.dot(X.T)
+            K *= -2.0
+            K += cp.asarray(xs_norm_sq)[:, None]
+            K += cp.einsum('ij,ij->i', X, X)[None, :]
+            cp.maximum(K, 0, out=K)
+            K *= -params
+            return cp.exp(K, out=K)
+
+        # contiguous rows for BLAS/SIMD and the vectorized exp ufunc
+        X_S, X = np.ascontiguousarray(X_S), np.ascontiguousarray(X)
+
+        # Poly, (x_s.x + 1)^order straight from the GEMM output
+        if self.kernel == 'poly':
+            K = np.dot(X_S, X.T, out=out)
+            if K.dtype.kind != 'f':
+                K = K.astype(np.float64)
+            if HAS_NUMBA:
+                finalize = _poly_finalize if parallel else _poly_finalize_serial
+                finalize(K, self.order)
+            else:
+                K += 1.0
+                np.power(K, self.order, out=K)
+            return K
+
+        if HAS_SIMSIMD and X.shape[1] <= SIMSIMD_MAX_FEATURES \
+                and X.dtype == X_S.dtype and X.dtype in (np.float32, np.float64):
+            # direct SIMD squared distances, no norm cancellation
+            threads = 0 if parallel else 1
+            if out is not None:
+                simsimd.cdist(X_S, X, metric='sqeuclidean', out=out,
+                              out_dtype=X.dtype.name, threads=threads)
+                K = out
+            else:
+                K = np.asarray(simsimd.cdist(X_S, X, metric='sqeuclidean',
+                                             out_dtype=X.dtype.name, threads=threads))
+            np.multiply(K, -params, out=K)
+            np.exp(K, out=K)
+            return K
+
+        # squared row norms, ||x_s - x||^2 = ||x_s||^2 + ||x||^2 - 2 x_s.x
+        xs_norm = xs_norm_sq if xs_norm_sq is not None else np.einsum('ij,ij->i', X_S, X_S)
+        x_norm = np.einsum('ij,ij->i', X, X)
+
+        K = np.dot(X_S, X.T, out=out)
+        if K.dtype.kind != 'f': # integer inputs, e.g. pixel values
+            K = K.astype(np.float64)
+
+        if HAS_NUMBA:
+            finalize = _rbf_finalize if parallel else _rbf_finalize_serial
+            finalize(K, xs_norm, x_norm, params)
+            return K
+
+        # squared distances and exp written into the GEMM output
+        K *= -2.0
+        K += xs_norm[:, None]
+        K += x_norm[None, :]
+        np.maximum(K, 0, out=K) # guard against round-off
+        K *= -params
+        np.exp(K, out=K)
         return K
 
 
+    def kernelDiag(self, X):
+        """Returns the kernel diagonal k(x,x) for each row of X.
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_samples, d_features)
+            The input samples.
+        """
+
+        if self.kernel == 'poly':
+            return (np.einsum('ij,ij->i', X, X) + 1.0)**self.order
+
+        return np.ones(X.shape[0], dtype=X.dtype if X.dtype.kind == 'f' else np.float64)
+
+
 
     def eigenDecomp_gramMatrix(self, K_centered):
         """Returns the leading q number of eigenvectors from the eigendecomposition
         of the centered gram matrix
 
+        Only the upper triangle of K_centered is read, and it is overwritten.
+
         Parameters
         ----------
         K : numpy array of shape (n_samples,n_samples)
@@ -145,24 +398,95 @@ class kPCA:
         from scipy.linalg import eigh
 
         numev = self.q #use class default if none is specified
-
-        w, v = eigh(K_centered)
-        w = w.reshape(-1,1)
-        w = np.flipud(w)
-        v = np.fliplr(v)
-        alphas = v[:,:numev]
+        n = K_centered.shape[0]
+
+        if self.device == 'cuda':
+            # cusolver syevd has no subset selection, keep the leading numev
+            w, v = cp.linalg.eigh(K_centered, UPLO='U')
+            w, v = cp.asnumpy(w[n-numev:]), cp.asnumpy(v[:, n-numev:])
+        elif 0 < numev < n//4:
+            # only the leading numev eigenpairs are needed (LAPACK ?syevr).
+            # K_centered.T is the Fortran ordered view of the same buffer, so
+            # LAPACK works in place; its lower triangle is our upper triangle
+            w, v = eigh(K_centered.T, lower=True, overwrite_a=True,
+                        subset_by_index=[n-numev, n-1])
+        else:
+            w, v = eigh(K_centered.T, lower=True, overwrite_a=True)
+        # eigh returns ascending eigenvalues; take the trailing numev as
+        # reversed views (a -numev: slice would select everything for q = 0)
+        k = w.shape[0] - numev
 
         #Each column is an eigen vector
-        lambdas = w[:numev]
+        alphas = v[:, k:][:, ::-1]
         #from biggest to smallest
-        alphs = alphas*np.squeeze(1/np.sqrt(lambdas))
+        lambdas = w[k:][::-1]
+        alphs = alphas/np.sqrt(lambdas)
 
 
 
         return alphs
 
 
-    def calc_reconstructionErrors(self, X,  X_S, K_mat, alphs):
+    def nystromDecomp_gramMatrix(self, X_S):
+        """Returns the landmarks, the column means of their uncentered gram
+        matrix and the leading q alphas of a Nystrom approximation of the
+        centered gram matrix of X_S.
+
+        The alphas are expressed on the centered landmarks, so the returned
+        triple can be used by calc_reconstructionErrors in place of
+        (X_S, Krow, alphs).
+
+        Parameters
+        ----------
+        X_S : numpy array of shape (n_sub, d_features)
+            The training samples.
+        """
+
+        numev = self.q
+        n_sub = X_S.shape[0]
+        m = self.n_landmarks
+
+        X_L = X_S[self.rng.choice(n_sub, size=m, replace=False, shuffle=False)]
+
+        K_mm = _symmetrize(self._to_host(self.gramMatrix(X_L, X_L)))
+
+        # center both blocks on the landmark mean, an approximation of the
+        # sample mean that keeps the uniform weights calc_reconstructionErrors
+        # expects
+        Krow = K_mm.sum(axis = 0)/m
+        Ksum = Krow.sum()/m
+        K_mm_centered = K_mm - Krow[:, None]
+        K_mm_centered -= Krow[None, :]
+        K_mm_centered += Ksum
+
+        K_nm = self._to_host(self.gramMatrix(X_L, X_S))
+        Kcol = K_nm.mean(axis = 1)
+        K_nm -= Krow[None, :]
+        K_nm -= Kcol[:, None]
+        K_nm += Ksum
+
+        # W = K_mm^{-1/2} on the non-null eigenspace of the centered landmarks
+        w, U = eigh(K_mm_centered)
+        keep = w > w[-1]*m*np.finfo(w.dtype).eps
+        W = U[:, keep]/np.sqrt(w[keep])
+
+        # covariance of the n_sub projected samples, (r x r)
+        KW = K_nm.dot(W)
+        M = KW.T.dot(KW)
+        r = M.shape[0]
+
+        if numev > 0:
+            _, V = eigh(M, subset_by_index=[r-min(numev, r), r-1])
+            V = V[:, ::-1]
+        else:
+            V = np.zeros((r, 0))
+
+        alphs = W.dot(V)
+
+        return X_L, Krow, alphs
+
+
+    def calc_reconstructionErrors(self, X,  X_S, Krow, alphs, xs_norm_sq = None):
         """Returns the reconstruction error projecting onto alphas.
 
         Parameters
@@ -173,9 +497,14 @@ class kPCA:
         alphs: numpy array of shape (n_samples, q)
             eigenvectors of centered gram matrix
 
+        Krow : numpy array of shape (n_subsamples,)
+            column means of the uncentered gram matrix of X_S
 
         X_S : numpy array of shape (n_subsamples, d_features), optional (default=None)
             Subsampling of the data. If none, the full kernel is used for projection
+
+        xs_norm_sq : numpy array of shape (n_subsamples,), optional (default=None)
+            squared row norms of X_S, computed once here if None
         """
 
 
@@ -187,38 +516,75 @@ class kPCA:
 
 
         #helper calcs
-        Krow = K_mat.sum(axis = 0)/n_sub #not normed!
         Ksum = (Krow).sum()/n_sub
-        sumalphs = np.ones(X_S.shape[0]).dot(alphs)
+        sumalphs = alphs.sum(axis = 0)
+        krow_alphs = np.dot(Krow,alphs) # batch independent
+        if xs_norm_sq is None:
+            xs_norm_sq = np.einsum('ij,ij->i', X_S, X_S)
 
 
-        reconstruction_errs = np.zeros(n_samples)
+        reconstruction_errs = np.zeros(n_samples, dtype=Krow.dtype)
 
-        for block_i in (range(0,n_samples,self.batch_size)):
-            if self.verbose:
-                percentDone = 100 * (block_i)/ n_samples;
-                print(f"Evaluating training set... {percentDone:.2f}%", end='\r')
+        # training side arrays are transferred once, batches of X per block
+        X_S, alphs, sumalphs, krow_alphs, xs_norm_sq = (self._to_device(a) for a in
+                                            (X_S, alphs, sumalphs, krow_alphs, xs_norm_sq))
+
+        n_jobs = (os.cpu_count() or 1) if self.n_jobs == -1 else self.n_jobs
+        inner_threads = n_jobs == 1 # threads inside a batch only when serial
 
+        # one kernel block buffer per scoring thread, reused across batches
+        use_buf = self.device == 'cpu' and X.dtype == X_S.dtype and X.dtype.kind == 'f'
+        local = threading.local()
 
+        def process_block(block_i):
             X_block = X[block_i:block_i+self.batch_size,:]
             n_block = X_block.shape[0]
 
-            k_L = self.gramMatrix(X_block, X_S)
+            k_L_buf = None
+            if use_buf:
+                if not hasattr(local, 'buf'):
+                    local.buf = np.empty(n_sub*min(self.batch_size, n_samples), dtype=X.dtype)
+                # leading slice of the flat buffer stays C-contiguous
+                k_L_buf = local.buf[:n_sub*n_block].reshape(n_sub, n_block)
+
+            k_L = self.gramMatrix(X_block, X_S, parallel=inner_threads, xs_norm_sq=xs_norm_sq,
+                                  out=k_L_buf)
+
 
+            ksum_col = np.sum(k_L,axis = 0)/n_sub
+            kxx = self._to_device(self.kernelDiag(X_block))
 
-            f_L = np.dot(k_L.T,alphs) - (sumalphs*np.ones((n_block,numev)) * \
-                         np.expand_dims((np.sum(k_L,axis=0).T/n_sub - Ksum),axis=1)) \
-                         -  np.ones((n_block, numev))*np.dot(Krow,alphs)
-            
+            if HAS_NUMBA and self.device == 'cpu':
+                finalize = _recon_finalize if inner_threads else _recon_finalize_serial
+                finalize(np.dot(k_L.T,alphs), ksum_col, krow_alphs, sumalphs,
+                         Ksum, kxx, reconstruction_errs[block_i:block_i+n_block])
+                return
 
-            errs_block = ( 1 - (2*np.sum(k_L,axis = 0)/n_sub).T + Ksum ) \
-                    - np.diag(np.dot(f_L,f_L.T))
+            f_L = np.dot(k_L.T,alphs) - sumalphs*(ksum_col - Ksum)[:, None] \
+                         - krow_alphs
 
+            errs_block = ( kxx - 2*ksum_col + Ksum ) \
+                    - np.einsum('ij,ij->i', f_L, f_L)
 
-            # f_L2 = np.dot(k_L.T, alphs) - (sumalphs * np.expand_dims((np.sum(k_L, axis=0)/n_sub - Ksum), axis=0)) - np.dot(Krow, alphs)
-            # errs_block2 = 1 - (2 * np.sum(k_L, axis=0)/n_sub) + Ksum - np.sum(f_L * f_L, axis=0)
-            
-            reconstruction_errs[block_i:block_i+self.batch_size] = errs_block
+            reconstruction_errs[block_i:block_i+self.batch_size] = self._to_host(errs_block)
+
+        blocks = range(0,n_samples,self.batch_size)
+
+        if inner_threads:
+            for block_i in blocks:
+                if self.verbose:
+                    percentDone = 100 * (block_i)/ n_samples;
+                    print(f"Evaluating training set... {percentDone:.2f}%", end='\r')
+
+                process_block(block_i)
+        else:
+            # blocks write disjoint slices; keep BLAS single threaded per block
+            limits = threadpool_limits(1, 'blas') if threadpool_limits else nullcontext()
+            with limits, ThreadPoolExecutor(max_workers=n_jobs) as pool:
+                for i, _ in enumerate(pool.map(process_block, blocks)):
+                    if self.verbose:
+                        percentDone = 100 * min((i+1)*self.batch_size, n_samples)/ n_samples
+                        print(f"Evaluating training set... {percentDone:.2f}%", end='\r')
 
 
         if self.verbose:
@@ -238,7 +604,13 @@ class kPCA:
             i.e. the proportion of outliers in the data set. Used when fitting to
             define the threshold on the decision function.
         """
-        threshold_ = np.quantile(scores,1-contamination)
+        # linear-interpolated (1-contamination) quantile from the two order
+        # statistics around it, selected in O(n)
+        h = (scores.size - 1)*(1 - contamination)
+        lo = int(np.floor(h))
+        hi = min(lo + 1, scores.size - 1)
+        part = np.partition(scores, [lo, hi])
+        threshold_ = part[lo] + (h - lo)*(part[hi] - part[lo])
         labels = np.ones(scores.shape[0])
         labels[scores < threshold_] = 0
 
@@ -259,6 +631,11 @@ class kPCA:
         The ground truth of the input samples (labels).
         """
 
+        dtype = self.dtype
+        if dtype is None:
+            dtype = np.float64
+        X = np.ascontiguousarray(X, dtype=dtype)
+
         n_samples, d_features = np.shape(X)
         self.d_features = d_features
 
@@ -275,38 +652,46 @@ class kPCA:
 
         n_sub = X_S.shape[0]
 
-        K_mat = self.gramMatrix(X_S,X_S)
+        if self.use_nystrom and n_sub > self.n_landmarks:
+            X_S, Krow, alphs = self.nystromDecomp_gramMatrix(X_S)
 
+            if self.verbose:
+                print("Computed Nystrom alphas","\n")
 
-        # symmetrize to correct minor numerical errors
-        K_mat = (K_mat + K_mat.T) / 2
+        else:
+            K_mat = self.gramMatrix(X_S,X_S)
 
-        #helper calcs
-        Krow = K_mat.sum(axis = 0)/n_sub #not normed!
-        Ksum = (Krow).sum()/n_sub
-        K_centered = np.zeros_like(K_mat)
-        # Looping over each element
-        for i in range(K_mat.shape[0]):    # Loop over rows
-            for j in range(K_mat.shape[1]):  # Loop over columns
-                K_centered[i][j] = K_mat[i][j] - Krow[i] - Krow[j] + Ksum
 
+            # symmetrize to correct minor numerical errors
+            _symmetrize(K_mat)
 
-        # one_n = np.ones((n_sub,n_sub)) / n_sub
-        # K_centered2 = K_mat - one_n.dot(K_mat - K_mat.dot(one_n)) + one_n.dot(K_mat).dot(one_n)
+            #helper calcs
+            Krow = K_mat.sum(axis = 0)/n_sub #not normed!
+            Ksum = (Krow).sum()/n_sub
+            # K_c[i,j] = K[i,j] - Krow[i] - Krow[j] + Ksum on the upper
+            # triangle, reusing the gram matrix buffer
+            K_centered = _center_upper(K_mat, Krow, Ksum)
 
-        if self.verbose:
-            print("Computed gram matrix")
 
-        alphs = self.eigenDecomp_gramMatrix(K_centered)
+            # one_n = np.ones((n_sub,n_sub)) / n_sub
+            # K_centered2 = K_mat - one_n.dot(K_mat - K_mat.dot(one_n)) + one_n.dot(K_mat).dot(one_n)
 
-        if self.verbose:
-                print("Computed alphas","\n")
+            if self.verbose:
+                print("Computed gram matrix")
+
+            alphs = self.eigenDecomp_gramMatrix(K_centered)
+            Krow = self._to_host(Krow)
+
+            if self.verbose:
+                    print("Computed alphas","\n")
 
         self.model_alphas = alphs
         self.model_X_S = X_S
-        self.model_K_mat = K_mat
+        self.model_Krow = Krow
+        self.model_xs_norm_sq = np.einsum('ij,ij->i', X_S, X_S)
 
-        reconstruction_errs = self.calc_reconstructionErrors(X,  X_S, K_mat, alphs)
+        reconstruction_errs = self.calc_reconstructionErrors(X,  X_S, Krow, alphs,
+                                                             self.model_xs_norm_sq)
 
         self.decision_scores_ = reconstruction_errs
 
@@ -329,7 +714,10 @@ class kPCA:
         if X_test.ndim == 1: # correct dimension if a single example is given
             X_test = np.expand_dims(X_test,axis = 0)
 
-        scores = self.calc_reconstructionErrors(X_test,  self.model_X_S, self.model_K_mat, self.model_alphas)
+        X_test = np.ascontiguousarray(X_test, dtype=self.model_X_S.dtype)
+
+        scores = self.calc_reconstructionErrors(X_test,  self.model_X_S, self.model_Krow, self.model_alphas,
+                                                self.model_xs_norm_sq)
 
         return scores
 